@@ -1,13 +1,58 @@
 import streamlit as st
-import sqlite3, uuid, time
+import sqlite3, secrets, threading, time, os, queue
+from contextlib import contextmanager
 from datetime import datetime
-from urllib.parse import urlencode
+from urllib.parse import quote
 
-DB_PATH = "shared_notes.db"
+# With STREAMLIT_EPHEMERAL=1 the database lives on tmpfs, eliminating disk
+# fsyncs entirely — fine for a share-a-note app whose data need not outlive
+# the server process. NOTES_DB_PATH overrides the location either way.
+if os.environ.get("STREAMLIT_EPHEMERAL") == "1" and os.path.isdir("/dev/shm"):
+    _DEFAULT_DB_PATH = "/dev/shm/shared_notes.db"
+else:
+    _DEFAULT_DB_PATH = "shared_notes.db"
+DB_PATH = os.environ.get("NOTES_DB_PATH", _DEFAULT_DB_PATH)
+
+# Static SQL as module constants so each connection's statement cache
+# (cached_statements) can reuse the compiled plans across calls.
+SQL_SAVE_NOTE = """
+    INSERT OR REPLACE INTO notes (id, title, content, updated_at)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_GET_NOTE = "SELECT id, title, content, updated_at FROM notes WHERE id = ?"
+SQL_INSERT_TOKEN = "INSERT INTO tokens (token, note_id, created_at) VALUES (?, ?, ?)"
+SQL_GET_TOKENS = "SELECT token, created_at FROM tokens WHERE note_id = ?"
+SQL_GET_NOTE_AUTH = """
+    SELECT n.updated_at,
+           EXISTS(SELECT 1 FROM tokens WHERE note_id = n.id) AS has_tokens,
+           EXISTS(SELECT 1 FROM tokens WHERE note_id = n.id AND token = ?) AS token_ok
+    FROM notes n WHERE n.id = ?
+"""
 
 # --- DB setup ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def _apply_pragmas(conn):
+    # Rows come back as sqlite3.Row: dict-style access without building a
+    # Python dict per fetch.
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    # WAL lets viewer reads run concurrently with editor writes instead of
+    # serializing behind the default DELETE journal.
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=5000")
+    c.execute("PRAGMA cache_size=-20000")  # 20 MiB page cache
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA foreign_keys=ON")
+    c.execute("PRAGMA mmap_size=268435456")
+
+@st.cache_resource
+def get_writer_conn():
+    """Single writer connection; SQLite under WAL allows one writer at a time."""
+    # isolation_level=None: we emit BEGIN IMMEDIATE/COMMIT ourselves so the
+    # write lock is taken up front instead of racing a deferred upgrade.
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                           isolation_level=None, cached_statements=256)
+    _apply_pragmas(conn)
     c = conn.cursor()
     c.execute("""
     CREATE TABLE IF NOT EXISTS notes (
@@ -23,41 +68,106 @@ def init_db():
         created_at REAL,
         FOREIGN KEY(note_id) REFERENCES notes(id)
     )""")
-    conn.commit()
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tokens_note_id ON tokens(note_id)")
     return conn
 
-conn = init_db()
+@st.cache_resource
+def get_reader_pool():
+    """Pool of read-only connections so concurrent viewers don't serialize
+    behind each other (WAL supports many readers alongside the writer)."""
+    get_writer_conn()  # make sure the schema exists before opening read-only
+    pool = queue.Queue()
+    for _ in range(os.cpu_count() or 2):
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True,
+                               check_same_thread=False, cached_statements=256)
+        _apply_pragmas(conn)
+        pool.put(conn)
+    return pool
+
+@contextmanager
+def reader_conn():
+    pool = get_reader_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
 
 # --- Helpers ---
+# The writer connection is shared by every session/thread in the process,
+# so writes are serialized here; without this, two sessions could
+# interleave their BEGIN IMMEDIATE / COMMIT pairs.
+_write_lock = threading.Lock()
+
 def save_note(note_id, title, content):
     now = time.time()
-    c = conn.cursor()
-    c.execute("""
-        INSERT OR REPLACE INTO notes (id, title, content, updated_at)
-        VALUES (?, ?, ?, ?)
-    """, (note_id, title, content, now))
-    conn.commit()
+    conn = get_writer_conn()
+    with _write_lock:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute(SQL_SAVE_NOTE, (note_id, title, content, now))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
 
 def get_note(note_id):
-    c = conn.cursor()
-    c.execute("SELECT id, title, content, updated_at FROM notes WHERE id = ?", (note_id,))
-    row = c.fetchone()
-    if not row:
-        return None
-    return {"id": row[0], "title": row[1], "content": row[2], "updated_at": row[3]}
-
-def create_token(note_id):
-    t = str(uuid.uuid4())[:8]
+    with reader_conn() as conn:
+        c = conn.cursor()
+        c.execute(SQL_GET_NOTE, (note_id,))
+        return c.fetchone()
+
+def get_note_auth(note_id, token):
+    """Cheap per-tick probe: updated_at plus token validity in one
+    statement, without pulling the note content."""
+    with reader_conn() as conn:
+        c = conn.cursor()
+        c.execute(SQL_GET_NOTE_AUTH, (token, note_id))
+        return c.fetchone()
+
+def create_tokens(note_id, n):
+    """Insert n tokens in one transaction — one fsync instead of n."""
     now = time.time()
-    c = conn.cursor()
-    c.execute("INSERT INTO tokens (token, note_id, created_at) VALUES (?, ?, ?)", (t, note_id, now))
-    conn.commit()
-    return t
+    rows = [(secrets.token_urlsafe(6), note_id, now) for _ in range(n)]
+    conn = get_writer_conn()
+    with _write_lock:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.executemany(SQL_INSERT_TOKEN, rows)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+    get_tokens_for_note.clear()
+    return [r[0] for r in rows]
 
+@st.cache_data(ttl=5, show_spinner=False)
 def get_tokens_for_note(note_id):
-    c = conn.cursor()
-    c.execute("SELECT token, created_at FROM tokens WHERE note_id = ?", (note_id,))
-    return c.fetchall()
+    with reader_conn() as conn:
+        c = conn.cursor()
+        c.execute(SQL_GET_TOKENS, (note_id,))
+        # Plain tuples: sqlite3.Row doesn't pickle into cache_data.
+        return [tuple(r) for r in c.fetchall()]
+
+def _share_base_url():
+    """Base URL for share links, resolved once per render.
+
+    NOTES_BASE_URL wins (set it to the public deploy URL, e.g.
+    https://genonotes.streamlit.app); otherwise compose a full
+    scheme://host:port from the server config — browser.serverAddress
+    alone defaults to a bare "localhost" with no scheme or port.
+    """
+    base = os.environ.get("NOTES_BASE_URL")
+    if base:
+        return base.rstrip("/")
+    host = st.get_option("browser.serverAddress") or "localhost"
+    port = st.get_option("browser.serverPort") or 8501
+    scheme = "https" if port == 443 else "http"
+    if port in (80, 443):
+        return f"{scheme}://{host}"
+    return f"{scheme}://{host}:{port}"
 
 # --- Streamlit UI ---
 st.set_page_config(page_title="Shared Notes", layout="wide")
@@ -68,27 +178,49 @@ mode = query.get("view", "editor")
 note_id_q = query.get("id", None)
 token_q = query.get("token", None)
 
+@st.fragment(run_every="2s")
+def _viewer_fragment(note_id, token):
+    # Only this fragment reruns on the 2 s tick — the rest of the page and
+    # the session (cached connections included) stay untouched.
+    # Token validity is re-checked on every tick: tokens can be created
+    # after a viewer opened the note and must take effect immediately, so
+    # the auth verdict is never cached.
+    meta = get_note_auth(note_id, token)
+    if meta is None:
+        st.error("Note not found.")
+        return
+    if meta["has_tokens"] and not meta["token_ok"]:
+        st.error("Invalid or missing token.")
+        return
+    # Only the content fetch is version-gated, keyed by note id so that
+    # switching ?id= within a session can't serve another note's row.
+    version = meta["updated_at"]
+    cache = st.session_state.setdefault("viewer_notes", {})
+    cached = cache.get(note_id)
+    if cached and cached[0] == version:
+        note = cached[1]
+    else:
+        note = get_note(note_id)
+        cache[note_id] = (version, note)
+    if note is None:
+        st.error("Note not found.")
+        return
+    st.subheader(note["title"] or "Untitled Note")
+    last_updated = datetime.fromtimestamp(note["updated_at"]).strftime("%Y-%m-%d %H:%M:%S")
+    st.caption(f"Last updated: {last_updated}")
+    note_placeholder = st.empty()
+    # A code block is far cheaper to render than a disabled text_area: no
+    # input widget state to diff on every 2 s tick.
+    note_placeholder.code(note["content"] or "", language="text")
+
 if mode == "viewer":
     # --- Viewer mode ---
     st.header("🔒 Note Viewer")
     if not note_id_q:
         st.error("Missing note ID. Example: ?view=viewer&id=NOTE_ID&token=TOKEN")
     else:
-        note = get_note(note_id_q)
-        if not note:
-            st.error("Note not found.")
-        else:
-            tokens = [t for (t, _) in get_tokens_for_note(note_id_q)]
-            if tokens and token_q not in tokens:
-                st.error("Invalid or missing token.")
-            else:
-                st.subheader(note["title"] or "Untitled Note")
-                last_updated = datetime.fromtimestamp(note["updated_at"]).strftime("%Y-%m-%d %H:%M:%S")
-                st.caption(f"Last updated: {last_updated}")
-                st.text_area("Note (read-only)", value=note["content"], height=400, disabled=True)
-                st.info("Auto-refresh every few seconds to see updates (or click Refresh).")
-                if st.button("🔄 Refresh"):
-                    st.rerun()
+        _viewer_fragment(note_id_q, token_q)
+        st.caption("This view refreshes automatically every 2 seconds.")
 
 else:
     # --- Editor mode ---
@@ -100,7 +232,7 @@ else:
         content = st.text_area("Write your note here:", height=300)
 
         if "editing_id" not in st.session_state:
-            st.session_state.editing_id = note_id_q or str(uuid.uuid4())[:8]
+            st.session_state.editing_id = note_id_q or secrets.token_urlsafe(6)
         note_id = st.session_state.editing_id
 
         if st.button("💾 Save / Update"):
@@ -111,21 +243,26 @@ else:
         st.markdown("### 🔗 Share Links")
         st.write("Generate up to 3 unique share tokens.")
 
-        if st.button("➕ Generate Share Token"):
+        n_tokens = st.number_input("How many tokens?", min_value=1, max_value=3, value=1)
+        if st.button("➕ Generate Share Tokens"):
             existing = get_tokens_for_note(note_id)
-            if len(existing) >= 3:
+            remaining = 3 - len(existing)
+            if remaining <= 0:
                 st.warning("Maximum 3 tokens already generated.")
             else:
-                t = create_token(note_id)
-                st.success(f"Token created: {t}")
+                created = create_tokens(note_id, min(int(n_tokens), remaining))
+                st.success(f"Tokens created: {', '.join(created)}")
 
         tokens = get_tokens_for_note(note_id)
         if tokens:
             st.markdown("**Share these links:**")
-            base_url = "http://genonotes.streamlit.app"  # Change to your Streamlit Cloud URL after deployment
+            base_url = _share_base_url()
+            # Tokens come from token_urlsafe and need no escaping, but the
+            # note id can be seeded from the ?id= query param, so it gets
+            # percent-encoded once before the per-token loop.
+            note_id_enc = quote(note_id, safe="")
             for t, _ in tokens:
-                params = {"view": "viewer", "id": note_id, "token": t}
-                share_url = f"{base_url}/?{urlencode(params)}"
+                share_url = f"{base_url}/?view=viewer&id={note_id_enc}&token={t}"
                 st.code(share_url, language="text")
         else:
             st.info("No tokens yet. Generate one to share your note.")